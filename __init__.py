@@ -1,14 +1,18 @@
-from .canvas_node import CanvasNode
+from .canvas_node import CanvasNode, CanvasSequenceNode, BiRefNetMattingBatch
 
 # 设置路由
 CanvasNode.setup_routes()
 
 NODE_CLASS_MAPPINGS = {
-    "CanvasNode": CanvasNode
+    "CanvasNode": CanvasNode,
+    "CanvasSequenceNode": CanvasSequenceNode,
+    "BiRefNetMattingBatch": BiRefNetMattingBatch
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "CanvasNode": "Canvas Node"
+    "CanvasNode": "Canvas Node",
+    "CanvasSequenceNode": "Canvas Sequence",
+    "BiRefNetMattingBatch": "BiRefNet Matting (Batch)"
 }
 
 WEB_DIRECTORY = "./js"
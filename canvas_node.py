@@ -16,6 +16,11 @@ import time
 import base64
 from PIL import Image
 import io
+import glob
+import queue
+import re
+import threading
+from .mask_codec import MASK_SIDECAR_EXT, decode_mask_array, decode_mask_base64, encode_mask, encode_mask_base64
 
 # 设置高精度计算
 torch.set_float32_matmul_precision('high')
@@ -50,6 +55,123 @@ class BiRefNet(torch.nn.Module):
         output = self.decoder(features)
         return [output]
 
+def find_canvas_mask(path_image):
+    """查找画布对应的 _mask 遮罩 (PNG 或紧凑 .ymask)，两种都存在时返回最新写入的"""
+    path_mask = path_image.replace('.png', '_mask.png')
+    path_sparse = os.path.splitext(path_image)[0] + '_mask' + MASK_SIDECAR_EXT
+    candidates = [p for p in (path_sparse, path_mask) if os.path.exists(p)]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+def is_in_directory(path, directory):
+    """判断解析符号链接后的路径是否位于目录内"""
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([directory, os.path.realpath(path)]) == directory
+
+def load_canvas_mask(path_image, root=None):
+    """读取画布对应的 _mask 遮罩，返回 uint8 数组，不存在时返回 None；指定 root 时遮罩必须位于其中"""
+    path = find_canvas_mask(path_image)
+    if path is None:
+        return None
+    if root is not None and not is_in_directory(path, root):
+        raise ValueError(f"Mask path must be inside the input directory: {path}")
+    
+    if path.endswith(MASK_SIDECAR_EXT):
+        with open(path, 'rb') as f:
+            return decode_mask_array(f.read())
+    return np.array(Image.open(path).convert('L'))
+
+def get_mask_bbox(mask_array, padding, width, height):
+    """计算遮罩非零区域的包围盒 (x, y, w, h)，带边距并限制在画布范围内"""
+    rows = np.flatnonzero(mask_array.any(axis=1))
+    cols = np.flatnonzero(mask_array.any(axis=0))
+    if rows.size == 0:
+        return 0, 0, width, height
+    x0 = max(0, int(cols[0]) - padding)
+    y0 = max(0, int(rows[0]) - padding)
+    x1 = min(width, int(cols[-1]) + 1 + padding)
+    y1 = min(height, int(rows[-1]) + 1 + padding)
+    if x1 <= x0 or y1 <= y0:
+        return 0, 0, width, height
+    return x0, y0, x1 - x0, y1 - y0
+
+def image_array_to_tensor(image_array, dtype=torch.float32):
+    """将RGB/RGBA uint8数组转换为 [H, W, 3] tensor，直接在目标精度下计算"""
+    image = torch.from_numpy(image_array)
+    if image.shape[-1] == 4:
+        alpha = image[..., 3:].to(dtype).div_(255.0)
+        # rgb * alpha + (1 - alpha) * 0.5
+        return image[..., :3].to(dtype).div_(255.0).sub_(0.5).mul_(alpha).add_(0.5)
+    return image.to(dtype).div_(255.0)
+
+def pil_to_image_tensor(img, dtype=torch.float32):
+    """将RGB/RGBA PIL图像转换为 [1, H, W, 3] tensor"""
+    return image_array_to_tensor(np.array(img), dtype)[None,]
+
+def list_canvas_frames(sequence):
+    """解析 input 目录下的目录或文件名通配符，返回按自然顺序排列的画布帧（不含 _mask 遮罩）"""
+    input_dir = os.path.realpath(folder_paths.get_input_directory())
+    
+    # 只允许读取 input 目录内的文件
+    sequence = os.path.normpath(os.path.join(input_dir, sequence))
+    if os.path.commonpath([input_dir, sequence]) != input_dir:
+        raise ValueError(f"Sequence path must be inside the input directory: {sequence}")
+    if os.path.isdir(sequence):
+        sequence = os.path.join(sequence, '*.png')
+    
+    def natural_key(path):
+        return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', os.path.basename(path))]
+    
+    frames = [p for p in glob.glob(sequence)
+              if not os.path.splitext(p)[0].endswith('_mask') and is_in_directory(p, input_dir)]
+    return sorted(frames, key=natural_key)
+
+def load_canvas_frame(path_image, root=None):
+    """解码一帧画布图像及其 _mask 遮罩，返回 uint8 数组；指定 root 时遮罩必须位于其中"""
+    i = Image.open(path_image)
+    i = ImageOps.exif_transpose(i)
+    if i.mode not in ['RGB', 'RGBA']:
+        i = i.convert('RGB')
+    return np.array(i), load_canvas_mask(path_image, root)
+
+def prefetch_canvas_frames(paths, depth=2, root=None):
+    """后台线程预先解码后续帧，当前帧转换时下一帧已在解码"""
+    frames = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    end = object()
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def worker():
+        try:
+            for path in paths:
+                if not put((path, load_canvas_frame(path, root))):
+                    return
+        except Exception as e:
+            put(e)
+        put(end)
+    
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
 class CanvasNode:
     _canvas_cache = {
         'image': None,
@@ -135,15 +257,35 @@ class CanvasNode:
             },
             "optional": {
                 "input_image": ("IMAGE",),
-                "input_mask": ("MASK",)
+                "input_mask": ("MASK",),
+                "output_region": (["full", "mask_bbox"], {"default": "full"}),
+                "bbox_padding": ("INT", {"default": 32, "min": 0, "max": 4096, "step": 1}),
+                "half_precision": ("BOOLEAN", {"default": False})
             }
         }
     
-    RETURN_TYPES = ("IMAGE", "MASK")
-    RETURN_NAMES = ("image", "mask")
+    RETURN_TYPES = ("IMAGE", "MASK", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("image", "mask", "crop_x", "crop_y", "crop_width", "crop_height")
     FUNCTION = "process_canvas_image"
     CATEGORY = "Ycanvas"
 
+    @classmethod
+    def IS_CHANGED(cls, canvas_image, **kwargs):
+        """画布或 _mask 遮罩文件更新时重新执行（如通过 /ycnode/upload_mask 上传）"""
+        m = hashlib.md5()
+        m.update(str(canvas_image).encode())
+        try:
+            path_image = folder_paths.get_annotated_filepath(canvas_image)
+            if os.path.exists(path_image):
+                m.update(str(os.path.getmtime(path_image)).encode())
+                path_mask = find_canvas_mask(path_image)
+                if path_mask:
+                    m.update(path_mask.encode())
+                    m.update(str(os.path.getmtime(path_mask)).encode())
+        except Exception as e:
+            print(f"Error checking canvas files: {str(e)}")
+        return m.hexdigest()
+
     def add_image_to_canvas(self, input_image):
         """处理输入图像"""
         try:
@@ -208,7 +350,8 @@ class CanvasNode:
             print(f"Error in add_mask_to_canvas: {str(e)}")
             return None
 
-    def process_canvas_image(self, canvas_image, trigger, output_switch, cache_enabled, input_image=None, input_mask=None):
+    def process_canvas_image(self, canvas_image, trigger, output_switch, cache_enabled, input_image=None, input_mask=None,
+                             output_region="full", bbox_padding=32, half_precision=False):
         try:
             current_execution = self.get_execution_id()
             print(f"Processing canvas image, execution ID: {current_execution}")
@@ -274,51 +417,56 @@ class CanvasNode:
             # 更新缓存开关状态
             self.__class__._canvas_cache['cache_enabled'] = cache_enabled
             
+            dtype = torch.float16 if half_precision else torch.float32
+            
+            path_image = None
             try:
-                # 尝试读取画布图像
+                # 尝试读取画布图像（保持PIL格式，裁剪后再转换）
                 path_image = folder_paths.get_annotated_filepath(canvas_image)
                 i = Image.open(path_image)
                 i = ImageOps.exif_transpose(i)
                 if i.mode not in ['RGB', 'RGBA']:
                     i = i.convert('RGB')
-                image = np.array(i).astype(np.float32) / 255.0
-                if i.mode == 'RGBA':
-                    rgb = image[..., :3]
-                    alpha = image[..., 3:]
-                    image = rgb * alpha + (1 - alpha) * 0.5
-                processed_image = torch.from_numpy(image)[None,]
             except Exception as e:
-                # 如果读取失败，创建白色画布
-                processed_image = torch.ones((1, 512, 512, 3), dtype=torch.float32)
+                # 如果读取失败，使用白色画布（遮罩仍按原路径读取）
+                i = None
+            
+            width, height = i.size if i is not None else (512, 512)
             
             try:
-                # 尝试读取遮罩图像
-                path_mask = path_image.replace('.png', '_mask.png')
-                if os.path.exists(path_mask):
-                    # 读取遮罩图像并转换为灰度
-                    mask = Image.open(path_mask).convert('L')
-                    
-                    # 转换为numpy数组并归一化 (0-1范围)
-                    mask_array = np.array(mask).astype(np.float32) / 255.0
-                    
-                    # 读取的遮罩是RGBA中A通道的可视化:
-                    # 白色(255/255=1.0)表示不透明区域
-                    # 黑色(0/255=0.0)表示透明区域
-                    # 因此不需要额外处理
-                    
-                    # 转换为PyTorch张量
-                    processed_mask = torch.from_numpy(mask_array)[None,]
-                    print(f"Loaded mask with shape: {processed_mask.shape}")
-                else:
-                    # 如果没有遮罩文件，创建全黑遮罩(全透明)
-                    processed_mask = torch.zeros((1, processed_image.shape[1], processed_image.shape[2]), dtype=torch.float32)
+                # 尝试读取遮罩图像 (uint8, 白色表示不透明区域，黑色表示透明区域)
+                mask_array = load_canvas_mask(path_image) if path_image else None
+                if mask_array is None:
                     print("Created black mask (transparent) as default")
             except Exception as e:
                 print(f"Error loading mask: {str(e)}")
-                # 创建默认黑色遮罩
-                processed_mask = torch.zeros((1, processed_image.shape[1], processed_image.shape[2]), dtype=torch.float32)
+                mask_array = None
                 print("Created black mask after error")
             
+            # 计算输出区域
+            if output_region == "mask_bbox" and mask_array is not None:
+                # 限制在画布与遮罩的公共区域内，保证图像和遮罩输出尺寸一致
+                crop_x, crop_y, crop_width, crop_height = get_mask_bbox(
+                    mask_array, bbox_padding, min(width, mask_array.shape[1]), min(height, mask_array.shape[0]))
+            else:
+                crop_x, crop_y, crop_width, crop_height = 0, 0, width, height
+            box = (crop_x, crop_y, crop_x + crop_width, crop_y + crop_height)
+            
+            if i is not None:
+                processed_image = pil_to_image_tensor(i.crop(box) if output_region == "mask_bbox" else i, dtype)
+            else:
+                processed_image = torch.ones((1, crop_height, crop_width, 3), dtype=dtype)
+            
+            if mask_array is not None:
+                # 仅在包围盒模式下裁剪，full 模式保持遮罩原样输出
+                if output_region == "mask_bbox":
+                    mask_array = mask_array[crop_y:crop_y + crop_height, crop_x:crop_x + crop_width]
+                processed_mask = torch.from_numpy(np.ascontiguousarray(mask_array)).to(dtype).div_(255.0)[None,]
+                print(f"Loaded mask with shape: {processed_mask.shape}")
+            else:
+                # 如果没有遮罩文件，创建全黑遮罩(全透明)
+                processed_mask = torch.zeros((1, processed_image.shape[1], processed_image.shape[2]), dtype=dtype)
+            
             # 输出处理
             if not output_switch:
                 return ()
@@ -327,7 +475,7 @@ class CanvasNode:
             self.update_persistent_cache()
             
             # 返回处理后的图像和遮罩
-            return (processed_image, processed_mask)
+            return (processed_image, processed_mask, crop_x, crop_y, crop_width, crop_height)
                 
         except Exception as e:
             print(f"Error in process_canvas_image: {str(e)}")
@@ -405,6 +553,35 @@ class CanvasNode:
                     'error': str(e)
                 })
 
+        @PromptServer.instance.routes.post("/ycnode/upload_mask")
+        async def upload_mask(request):
+            """保存紧凑格式的 _mask 遮罩 (.ymask)"""
+            try:
+                data = await request.json()
+                file_name = os.path.basename(data["filename"])
+                
+                # 解码校验后写入原始字节
+                mask_array = decode_mask_base64(data["mask"])
+                mask_bytes = encode_mask(mask_array)
+                
+                mask_name = os.path.splitext(file_name)[0] + '_mask' + MASK_SIDECAR_EXT
+                path_mask = os.path.join(folder_paths.get_input_directory(), mask_name)
+                with open(path_mask, 'wb') as f:
+                    f.write(mask_bytes)
+                print(f"Saved sparse mask to {path_mask} ({len(mask_bytes)} bytes)")
+                
+                return web.json_response({
+                    'success': True,
+                    'name': mask_name
+                })
+                
+            except Exception as e:
+                print(f"Error in upload_mask: {str(e)}")
+                return web.json_response({
+                    'success': False,
+                    'error': str(e)
+                }, status=400)
+
     def store_image(self, image_data):
         # 将base64数据转换为PIL Image并存储
         if isinstance(image_data, str) and image_data.startswith('data:image'):
@@ -423,11 +600,110 @@ class CanvasNode:
             return f"data:image/png;base64,{img_str}"
         return None
 
+class CanvasSequenceNode:
+    """按帧序列读取画布图像和 _mask 遮罩，输出 IMAGE/MASK 批次
+    
+    每次执行只解码 start_frame 起的 frame_count 帧，节点内存由该窗口决定；
+    chunk_mb 只决定输出列表中每个批次的大小。
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "sequence": ("STRING", {"default": "canvas_frames/*.png"}),
+                "start_frame": ("INT", {"default": 0, "min": 0, "max": 999999, "step": 1}),
+                "frame_count": ("INT", {"default": 0, "min": 0, "max": 999999, "step": 1}),
+                "chunk_mb": ("INT", {"default": 0, "min": 0, "max": 131072, "step": 64}),
+                "half_precision": ("BOOLEAN", {"default": False})
+            },
+            "optional": {
+                "prefetch": ("INT", {"default": 2, "min": 1, "max": 16, "step": 1})
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION = "process_sequence"
+    CATEGORY = "Ycanvas"
+
+    def get_chunk_size(self, frame_count, height, width, dtype, chunk_mb):
+        """根据每批次大小计算帧数，0 表示全部输出为一个批次"""
+        if chunk_mb <= 0:
+            return frame_count
+        # 图像3通道 + 遮罩1通道
+        frame_bytes = height * width * 4 * torch.finfo(dtype).bits // 8
+        return max(1, min(frame_count, (chunk_mb * 1024 * 1024) // frame_bytes))
+
+    def get_window(self, sequence, start_frame, frame_count):
+        """返回本次执行要读取的帧，frame_count 为 0 表示读取到末尾"""
+        paths = list_canvas_frames(sequence)
+        end = start_frame + frame_count if frame_count > 0 else len(paths)
+        return paths[start_frame:end]
+
+    def process_sequence(self, sequence, start_frame, frame_count, chunk_mb, half_precision, prefetch=2):
+        paths = self.get_window(sequence, start_frame, frame_count)
+        if not paths:
+            raise ValueError(f"No canvas frames found for: {sequence} (start_frame={start_frame})")
+        
+        dtype = torch.float16 if half_precision else torch.float32
+        images, masks = [], []
+        chunk_images = chunk_masks = None
+        frame_size = None
+        loaded = 0
+        index = 0
+        
+        for path, (image_array, mask_array) in tqdm(prefetch_canvas_frames(paths, prefetch, folder_paths.get_input_directory()), total=len(paths), desc="Canvas frames"):
+            height, width = image_array.shape[:2]
+            
+            # 批次内所有帧尺寸必须一致
+            if frame_size is None:
+                frame_size = (height, width)
+                chunk_size = self.get_chunk_size(len(paths), height, width, dtype, chunk_mb)
+            elif (height, width) != frame_size:
+                raise ValueError(f"Frame {path} has size {width}x{height}, expected {frame_size[1]}x{frame_size[0]}")
+            
+            if chunk_images is None:
+                count = min(chunk_size, len(paths) - loaded)
+                chunk_images = torch.empty((count, height, width, 3), dtype=dtype)
+                chunk_masks = torch.zeros((count, height, width), dtype=dtype)
+                index = 0
+            
+            chunk_images[index] = image_array_to_tensor(image_array, dtype)
+            if mask_array is not None:
+                if mask_array.shape != (height, width):
+                    raise ValueError(f"Mask for {path} has size {mask_array.shape[1]}x{mask_array.shape[0]}, expected {width}x{height}")
+                chunk_masks[index] = torch.from_numpy(mask_array).to(dtype).div_(255.0)
+            index += 1
+            loaded += 1
+            
+            if index == chunk_images.shape[0]:
+                images.append(chunk_images)
+                masks.append(chunk_masks)
+                chunk_images = chunk_masks = None
+        
+        print(f"Loaded {len(paths)} canvas frames in {len(images)} chunk(s)")
+        return (images, masks)
+
+    @classmethod
+    def IS_CHANGED(cls, sequence, start_frame, frame_count, **kwargs):
+        m = hashlib.md5()
+        for path in cls().get_window(sequence, start_frame, frame_count):
+            m.update(path.encode())
+            m.update(str(os.path.getmtime(path)).encode())
+            path_mask = find_canvas_mask(path)
+            if path_mask:
+                m.update(str(os.path.getmtime(path_mask)).encode())
+        return m.hexdigest()
+
 class BiRefNetMatting:
+    # 模型缓存为类级别，所有节点实例和 /matting 路由共享同一份模型
+    model_cache = {}
+
     def __init__(self):
         self.model = None
         self.model_path = None
-        self.model_cache = {}
         # 使用 ComfyUI models 目录
         self.base_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "models")
 
@@ -587,6 +863,107 @@ class BiRefNetMatting:
         m.update(str(refinement).encode())
         return m.hexdigest()
 
+class BiRefNetMattingBatch:
+    """批量抠图节点，按显存预算分块推理"""
+
+    # 模型输入分辨率
+    MODEL_RESOLUTION = 1024
+    # 单张图像在 1024x1024 推理时的显存估算 (MB)
+    INFERENCE_MB_PER_IMAGE = 1536
+    # 归一化时输出值域小于该值视为平坦输出，不做拉伸
+    NORMALIZE_EPS = 1e-4
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "threshold": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "memory_budget_mb": ("INT", {"default": 4096, "min": 256, "max": 131072, "step": 256}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
+    FUNCTION = "matting_batch"
+    CATEGORY = "Ycanvas"
+
+    def __init__(self):
+        # 复用单图抠图的模型加载和类级别模型缓存
+        self.matting = BiRefNetMatting()
+
+    def get_chunk_size(self, batch_size, height, width, memory_budget_mb, model_mb=0):
+        """根据显存预算（扣除模型权重）计算每块的图像数量"""
+        # 推理开销 + 输出插值到原始尺寸的 float32 结果
+        per_image_mb = self.INFERENCE_MB_PER_IMAGE + (height * width * 4) / (1024 * 1024)
+        chunk_size = int((memory_budget_mb - model_mb) // per_image_mb)
+        return max(1, min(batch_size, chunk_size))
+
+    def preprocess_batch(self, images, device):
+        """预处理图像批次 [B, H, W, C] -> [B, 3, 1024, 1024]"""
+        x = images[..., :3].permute(0, 3, 1, 2).to(device=device, dtype=torch.float32)
+        x = F.interpolate(
+            x,
+            size=(self.MODEL_RESOLUTION, self.MODEL_RESOLUTION),
+            mode='bilinear',
+            align_corners=False,
+            antialias=True
+        )
+        mean = torch.tensor([0.485, 0.456, 0.406], device=device).view(1, 3, 1, 1)
+        std = torch.tensor([0.229, 0.224, 0.225], device=device).view(1, 3, 1, 1)
+        return (x - mean) / std
+
+    def matting_batch(self, image, threshold, memory_budget_mb):
+        if not self.matting.load_model("BiRefNet/model.safetensors"):
+            raise RuntimeError("Failed to load model")
+        model = self.matting.model
+
+        if image.dim() == 3:
+            image = image.unsqueeze(0)
+
+        batch_size, height, width = image.shape[0], image.shape[1], image.shape[2]
+        device = next(model.parameters()).device
+        model_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / (1024 * 1024)
+        chunk_size = self.get_chunk_size(batch_size, height, width, memory_budget_mb, model_mb)
+        print(f"Matting {batch_size} images of size {width}x{height} in chunks of {chunk_size}")
+
+        masks = torch.empty((batch_size, height, width), dtype=torch.float32)
+
+        with torch.no_grad():
+            for start in tqdm(range(0, batch_size, chunk_size), desc="BiRefNet matting"):
+                chunk = image[start:start + chunk_size]
+                processed = self.preprocess_batch(chunk, device)
+
+                result = model(processed)[-1].sigmoid()
+                if result.dim() == 3:
+                    result = result.unsqueeze(1)
+
+                result = F.interpolate(
+                    result,
+                    size=(height, width),
+                    mode='bilinear',
+                    align_corners=True
+                )
+
+                # 每张图像单独归一化，平坦输出保持原值，避免放大浮点噪声
+                mi = result.amin(dim=(1, 2, 3), keepdim=True)
+                ma = result.amax(dim=(1, 2, 3), keepdim=True)
+                value_range = ma - mi
+                flat = value_range < self.NORMALIZE_EPS
+                result = torch.where(flat, result, (result - mi) / value_range.clamp_min(self.NORMALIZE_EPS))
+
+                if threshold > 0:
+                    result = (result > threshold).float()
+
+                masks[start:start + chunk.shape[0]] = result[:, 0].cpu()
+
+                del processed, result
+                if device.type == 'cuda':
+                    torch.cuda.empty_cache()
+
+        masked_images = image[..., :3].cpu() * masks.unsqueeze(-1)
+        return (masked_images, masks)
+
 @PromptServer.instance.routes.post("/matting")
 async def matting(request):
     try:
@@ -610,7 +987,11 @@ async def matting(request):
         
         # 转换结果为base64,包含原始alpha信息
         result_image = convert_tensor_to_base64(matted_image, alpha_mask, original_alpha)
-        result_mask = convert_tensor_to_base64(alpha_mask)
+        if data.get("mask_format") == "rle":
+            # 紧凑格式: 包围盒 + 游程编码
+            result_mask = encode_mask_base64(alpha_mask.squeeze())
+        else:
+            result_mask = convert_tensor_to_base64(alpha_mask)
         
         return web.json_response({
             "matted_image": result_image,
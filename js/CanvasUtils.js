@@ -140,37 +140,43 @@ export class CanvasUtils {
                     });
 
                     if (resp.status === 200) {
-                        // 保存遮罩图像
-                        maskCanvas.toBlob(async (maskBlob) => {
-                            const maskFormData = new FormData();
-                            const maskFileName = fileName.replace(/\.[^/.]+$/, '') + '_mask.png';
-                            maskFormData.append("image", maskBlob, maskFileName);
-                            maskFormData.append("overwrite", "true");
-
-                            try {
-                                const maskResp = await fetch("/upload/image", {
-                                    method: "POST",
-                                    body: maskFormData,
-                                });
-
-                                if (maskResp.status === 200) {
-                                    const data = await resp.json();
-                                    canvas.widget.value = data.name;
-                                    // 触发节点更新
-                                    if (canvas.node) {
-                                        canvas.node.setDirtyCanvas(true);
-                                        app.graph.runStep();
-                                    }
-                                    resolve(true);
-                                } else {
-                                    console.error("Error saving mask: " + maskResp.status);
-                                    resolve(false);
+                        // 保存遮罩为紧凑格式 (_mask.ymask)，大小与编辑区域相关
+                        try {
+                            const maskData = maskCtx.getImageData(0, 0, maskCanvas.width, maskCanvas.height).data;
+                            const gray = new Uint8Array(maskCanvas.width * maskCanvas.height);
+                            for (let i = 0; i < gray.length; i++) {
+                                gray[i] = maskData[i * 4];
+                            }
+                            const encodedMask = await CanvasUtils.encodeMask(gray, maskCanvas.width, maskCanvas.height);
+
+                            const maskResp = await fetch("/ycnode/upload_mask", {
+                                method: "POST",
+                                headers: {
+                                    "Content-Type": "application/json",
+                                },
+                                body: JSON.stringify({
+                                    filename: fileName,
+                                    mask: encodedMask
+                                })
+                            });
+
+                            if (maskResp.status === 200) {
+                                const data = await resp.json();
+                                canvas.widget.value = data.name;
+                                // 触发节点更新
+                                if (canvas.node) {
+                                    canvas.node.setDirtyCanvas(true);
+                                    app.graph.runStep();
                                 }
-                            } catch (error) {
-                                console.error("Error saving mask:", error);
+                                resolve(true);
+                            } else {
+                                console.error("Error saving mask: " + maskResp.status);
                                 resolve(false);
                             }
-                        }, "image/png");
+                        } catch (error) {
+                            console.error("Error saving mask:", error);
+                            resolve(false);
+                        }
                     } else {
                         console.error(resp.status + " - " + resp.statusText);
                         resolve(false);
@@ -183,6 +189,93 @@ export class CanvasUtils {
         });
     }
 
+    /**
+     * 将灰度遮罩编码为紧凑格式（包围盒 + 游程编码，与 mask_codec.py 一致）
+     * @param {Uint8Array} gray - 灰度遮罩数据，每像素一个字节
+     * @param {number} width - 宽度
+     * @param {number} height - 高度
+     * @returns {Promise<string>} data URL
+     */
+    static async encodeMask(gray, width, height) {
+        // 以占多数的纯黑或纯白作为背景
+        let zeros = 0;
+        let whites = 0;
+        for (let i = 0; i < gray.length; i++) {
+            if (gray[i] === 0) zeros++;
+            else if (gray[i] === 255) whites++;
+        }
+        const background = whites > zeros ? 255 : 0;
+
+        // 计算非背景像素的包围盒
+        let x0 = width, y0 = height, x1 = 0, y1 = 0;
+        for (let y = 0; y < height; y++) {
+            const row = y * width;
+            for (let x = 0; x < width; x++) {
+                if (gray[row + x] !== background) {
+                    if (x < x0) x0 = x;
+                    if (x >= x1) x1 = x + 1;
+                    if (y < y0) y0 = y;
+                    y1 = y + 1;
+                }
+            }
+        }
+        if (x1 <= x0 || y1 <= y0) {
+            x0 = y0 = x1 = y1 = 0;
+        }
+
+        // 包围盒内逐行游程编码
+        const values = [];
+        const lengths = [];
+        for (let y = y0; y < y1; y++) {
+            const row = y * width;
+            for (let x = x0; x < x1; x++) {
+                const value = gray[row + x];
+                const last = values.length - 1;
+                if (last >= 0 && values[last] === value) {
+                    lengths[last]++;
+                } else {
+                    values.push(value);
+                    lengths.push(1);
+                }
+            }
+        }
+
+        const runCount = values.length;
+        const body = new Uint8Array(runCount * 5);
+        body.set(values, 0);
+        const bodyView = new DataView(body.buffer);
+        for (let i = 0; i < runCount; i++) {
+            bodyView.setUint32(runCount + i * 4, lengths[i], true);
+        }
+        const compressed = new Uint8Array(await new Response(
+            new Blob([body]).stream().pipeThrough(new CompressionStream("deflate"))
+        ).arrayBuffer());
+
+        // 头部: 魔数, 版本, 高, 宽, 背景值, 包围盒(x0, y0, x1, y1), 游程数 (小端)
+        const header = new Uint8Array(34);
+        const headerView = new DataView(header.buffer);
+        header.set([0x59, 0x4d, 0x53, 0x4b], 0);  // "YMSK"
+        headerView.setUint8(4, 1);
+        headerView.setUint32(5, height, true);
+        headerView.setUint32(9, width, true);
+        headerView.setUint8(13, background);
+        headerView.setUint32(14, x0, true);
+        headerView.setUint32(18, y0, true);
+        headerView.setUint32(22, x1, true);
+        headerView.setUint32(26, y1, true);
+        headerView.setUint32(30, runCount, true);
+
+        const bytes = new Uint8Array(header.length + compressed.length);
+        bytes.set(header, 0);
+        bytes.set(compressed, header.length);
+
+        let binary = "";
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        return "data:application/x-ycanvas-mask;base64," + btoa(binary);
+    }
+
     /**
      * 转换张量为图像数据
      * @param {Object} tensor - 张量数据
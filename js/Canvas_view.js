@@ -513,7 +513,9 @@ async function createCanvasWidget(node, widget, app) {
                                 body: JSON.stringify({
                                     image: imageData,
                                     threshold: 0.5,
-                                    refinement: 1
+                                    refinement: 1,
+                                    // 遮罩使用紧凑格式传输
+                                    mask_format: "rle"
                                 })
                             });
                             
@@ -0,0 +1,123 @@
+import base64
+import struct
+import zlib
+
+import numpy as np
+import torch
+from PIL import Image
+
+# 稀疏遮罩格式: 包围盒 + 游程编码 (RLE)
+# 头部: 魔数, 版本, 高, 宽, 背景值, 包围盒(x0, y0, x1, y1), 游程数
+# 数据(zlib压缩): 游程值 uint8[n], 游程长度 uint32[n]
+MASK_MAGIC = b'YMSK'
+MASK_VERSION = 1
+MASK_SIDECAR_EXT = '.ymask'
+MASK_DATA_URL_PREFIX = 'data:application/x-ycanvas-mask;base64,'
+
+_HEADER = struct.Struct('<4sBIIBIIIII')
+
+
+def mask_to_uint8(mask):
+    """将 MASK tensor ([H, W] 或 [1, H, W], 0-1) 或 uint8 数组转换为 uint8 [H, W] 数组"""
+    if isinstance(mask, torch.Tensor):
+        if mask.dim() == 3 and mask.shape[0] == 1:
+            mask = mask.squeeze(0)
+        if mask.dim() != 2:
+            raise ValueError(f"Expected a single mask [H, W], got shape {tuple(mask.shape)}")
+        return mask.detach().float().clamp(0, 1).mul(255).round().to(torch.uint8).cpu().numpy()
+
+    mask = np.asarray(mask)
+    if mask.ndim == 3 and mask.shape[0] == 1:
+        mask = mask[0]
+    if mask.ndim != 2 or mask.dtype != np.uint8:
+        raise ValueError(f"Expected a uint8 mask [H, W], got {mask.dtype} {mask.shape}")
+    return mask
+
+
+def encode_mask(mask):
+    """将遮罩编码为包围盒 + RLE 的紧凑字节串，大小与编辑区域相关而与画布尺寸无关"""
+    arr = mask_to_uint8(mask)
+    height, width = arr.shape
+
+    # 以占多数的纯黑或纯白作为背景
+    background = 255 if np.count_nonzero(arr == 255) > np.count_nonzero(arr == 0) else 0
+
+    changed = arr != background
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        header = _HEADER.pack(MASK_MAGIC, MASK_VERSION, height, width, background, 0, 0, 0, 0, 0)
+        return header + zlib.compress(b'')
+
+    cols = np.flatnonzero(changed.any(axis=0))
+    x0, x1 = int(cols[0]), int(cols[-1]) + 1
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+
+    region = arr[y0:y1, x0:x1].ravel()
+    starts = np.concatenate(([0], np.flatnonzero(region[1:] != region[:-1]) + 1))
+    values = region[starts]
+    lengths = np.diff(np.append(starts, region.size)).astype('<u4')
+
+    header = _HEADER.pack(MASK_MAGIC, MASK_VERSION, height, width, background, x0, y0, x1, y1, starts.size)
+    return header + zlib.compress(values.tobytes() + lengths.tobytes())
+
+
+def decode_mask_array(data):
+    """将紧凑字节串解码为 uint8 [H, W] 数组"""
+    if len(data) < _HEADER.size:
+        raise ValueError("Mask data is too short")
+
+    magic, version, height, width, background, x0, y0, x1, y1, n_runs = _HEADER.unpack_from(data)
+    if magic != MASK_MAGIC:
+        raise ValueError("Not a Ycanvas mask")
+    if version != MASK_VERSION:
+        raise ValueError(f"Unsupported mask version: {version}")
+
+    # 头部来自客户端，分配内存前先校验
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    if max_pixels and height * width > max_pixels:
+        raise ValueError(f"Mask size {width}x{height} exceeds limit of {max_pixels} pixels")
+    if not (x0 <= x1 <= width and y0 <= y1 <= height):
+        raise ValueError(f"Invalid mask bounding box ({x0}, {y0}, {x1}, {y1}) for size {width}x{height}")
+    if n_runs > (x1 - x0) * (y1 - y0):
+        raise ValueError("Mask has more runs than pixels in its bounding box")
+    if n_runs == 0 and (x1 > x0 or y1 > y0):
+        raise ValueError("Mask has a bounding box but no runs")
+
+    arr = np.full((height, width), background, dtype=np.uint8)
+    if n_runs == 0:
+        return arr
+
+    # 限制解压输出长度，防止压缩炸弹
+    expected = n_runs * 5
+    decompressor = zlib.decompressobj()
+    body = decompressor.decompress(data[_HEADER.size:], expected)
+    if len(body) != expected or decompressor.unconsumed_tail:
+        raise ValueError("Mask run data has unexpected length")
+    if not decompressor.eof or decompressor.unused_data:
+        raise ValueError("Mask run data is truncated or has trailing bytes")
+
+    values = np.frombuffer(body, dtype=np.uint8, count=n_runs)
+    lengths = np.frombuffer(body, dtype='<u4', count=n_runs, offset=n_runs)
+    if int(lengths.sum()) != (y1 - y0) * (x1 - x0):
+        raise ValueError("Mask runs do not match bounding box")
+
+    arr[y0:y1, x0:x1] = np.repeat(values, lengths).reshape(y1 - y0, x1 - x0)
+    return arr
+
+
+def decode_mask(data, dtype=torch.float32):
+    """将紧凑字节串解码为 MASK tensor [1, H, W]"""
+    arr = decode_mask_array(data)
+    return torch.from_numpy(arr).to(dtype).div_(255.0)[None,]
+
+
+def encode_mask_base64(mask):
+    """编码为用于传输的 data URL"""
+    return MASK_DATA_URL_PREFIX + base64.b64encode(encode_mask(mask)).decode()
+
+
+def decode_mask_base64(data_url):
+    """解码 data URL 为 uint8 [H, W] 数组"""
+    if data_url.startswith(MASK_DATA_URL_PREFIX):
+        data_url = data_url[len(MASK_DATA_URL_PREFIX):]
+    return decode_mask_array(base64.b64decode(data_url))